@@ -1,28 +1,51 @@
 """Airmomo
 """
-import os
+from __future__ import annotations
 
-from typing import List
-from dotenv import load_dotenv
-from chromadb import PersistentClient as PersistentChroma
-from chromadb.utils.embedding_functions.openai_embedding_function import OpenAIEmbeddingFunction
-from embeding_functions.zhipu_embeding_function import ZhiPuAIEmbeddingFunction
-from openai import OpenAI, BadRequestError
-from util import github, parse
+import asyncio
+from typing import TYPE_CHECKING, List
+from util import context, github, parse
+
+# 只用于类型注解，避免导入时加载 openai
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+# 总结提示词的版本，修改 get_summarize 或 get_summarize_retry 的提示词时需要更新，避免复用旧提示词生成的总结内容
+SUMMARIZE_PROMPT_VERSION = "1"
 
 
 class ChatStarGithub():
     """Main Class"""
 
-    def __init__(self, llm: OpenAI, model: str):
+    def __init__(self, llm: OpenAI, model: str, context_token_budget: int = 4000, description_max_tokens: int = 200,
+                 async_llm: AsyncOpenAI | None = None, timeout: float | None = None):
         """Init 
 
         Args:
             llm (OpenAI): LLM客户端实例, 需要使用 OpenAI 接口规范的模型
             model (str): LLM模型的名称
+            context_token_budget (int, optional): 评估与选择时Repositories信息的最大Token数量. Defaults to 4000.
+            description_max_tokens (int, optional): 评估与选择时每个Repository描述内容的最大Token数量. Defaults to 200.
+            async_llm (AsyncOpenAI | None, optional): 异步LLM客户端实例，用于可取消的检索调用. Defaults to None.
+            timeout (float | None, optional): 每次调用LLM的超时时间（秒）. Defaults to None，即使用客户端的默认超时时间.
         """
         self.llm = llm
         self.model = model
+        self.context_token_budget = context_token_budget
+        self.description_max_tokens = description_max_tokens
+        self.async_llm = async_llm
+        self.timeout = timeout
+
+    def get_async_llm(self) -> AsyncOpenAI:
+        """Return async llm, raise an error if it is not provided."""
+        if self.async_llm is None:
+            raise ValueError(
+                "Please provide an async LLM client (async_llm) to use the async methods.")
+        return self.async_llm
+
+    def warm_up(self) -> None:
+        """预先加载打包评估与选择内容时使用的分词器，避免首次检索时再进行加载"""
+        context.get_tokenizer()
 
     def get_summarize(self, document_content: str) -> str:
         """通过LLM对文档内容（原始长文本）进行总结并按XML格式输出的总结内容。
@@ -36,6 +59,7 @@ class ChatStarGithub():
         chat_completion = self.llm.chat.completions.create(
             model=self.model,
             temperature=0.2,
+            timeout=self.timeout,
             messages=[
                 {"role": "system",
                     "content": "你是一个文档总结助手，用中文输出总结的内容，并使用XML格式化返回的内容，生成的内容以示例为准，不需要生成其他标签的内容。示例：\
@@ -76,6 +100,7 @@ class ChatStarGithub():
         chat_completion = self.llm.chat.completions.create(
             model=self.model,
             temperature=0.7,
+            timeout=self.timeout,
             messages=[
                 {"role": "system",
                     "content": "你是一个文档总结助手，用中文输出总结的内容，并使用XML格式化返回的内容，生成的内容以示例为准，不需要生成其他标签的内容。示例：\
@@ -106,92 +131,128 @@ class ChatStarGithub():
         assistant_generate_message = chat_completion.choices[0].message.content
         return assistant_generate_message
 
-    def get_appropriate_repositories(self, documents: List[str], requirement: str) -> str:
+    def get_appropriate_repositories_messages(self, documents: List[str], requirement: str, distances: List[float] | None = None) -> List[dict]:
+        """构建通过LLM评估并选择能够解决需求的Repositories的对话内容。
+
+        Args:
+            documents (List[str]): 一至多个文档的内容（对原始长文本总结生成的内容）
+            requirement (str): 对问题或需求的描述
+            distances (List[float] | None, optional): 文档与检索内容的向量距离，用于在Token预算内优先保留更相关的文档. Defaults to None.
+
+        Returns:
+            List[dict]: 对话内容
+        """
+        # 优化：在Token预算内按相似度打包压缩后的文档，避免检索数量增加时上下文过长导致评估耗时过长或超出模型上下文限制。
+        documents_content = context.build_rerank_context(
+            documents, distances=distances, token_budget=self.context_token_budget,
+            description_max_tokens=self.description_max_tokens)
+        return [
+            {"role": "system",
+                "content": "首先，你需要对这些Repositories进行分析，理解它们实现的功能以及发现它们可能的应用场景。\
+                    最后，能够根据我的提问或要求，对这些Repositories进行评估，从中选择并按格式输出那些能够解决我的问题、达到我的要求的、合适的Repositories。\
+                    如果不存在任何的Repository或者没有合适的Repository，则只需返回'```xml<Repositories></Repositories>```'。"},
+            {"role": "user",
+                "content": f"<Repositories>(... nothing ...)</Repositories>"},
+            {"role": "assistant",
+                "content": f"```xml<Repositories></Repositories>```"},
+            {"role": "user",
+                "content": f"<Repositories>(... {documents_content} ...)</Repositories>"},
+            {"role": "assistant",
+                "content": "好的，我已经对这些Repositories都进行分析，并且充分地理解它们实现的功能以及发现它们可能的应用场景。具体如下： \
+                    ```xml<Repositories> \
+                    <Repository> \
+                    <name>(该Repository的名称)</name> \
+                    <owner>(该Repository的作者)</owner> \
+                    <url>(该Repository的Github链接)</url> \
+                    <descrpition>(... 结合提供文档信息进行分析，生成一段对于该Repository描述，描述必须包括其实现的功能、适用的应用场景等具有关键性、相关性的内容。 ...)</descrpition> \
+                    <keywords>(... 根据提供文档信息生成关于该Repository合适的中文关键字。关键词之间应以逗号隔开。 ...)</keywords> \
+                    </Repository> ... ( ... one or more repositories ...)\
+                    </Repositories>```"},
+            {"role": "user",
+                "content": f"我的提问或要求是：{requirement}， \
+                    你需要从这些Repositories中选择并按格式输出那些能够解决我的问题、达到我的要求的、合适的Repositories。回复的内容格式如下：\
+                    ```xml<Repositories> \
+                    <Repository> \
+                    <name>(该Repository的名称)</name> \
+                    <owner>(该Repository的作者)</owner> \
+                    <url>(该Repository的Github链接)</url> \
+                    <descrpition>(... 结合上下文进行分析，生成一段对于该Repository描述，描述必须包括其实现的功能、适用的应用场景等具有关键性、相关性的内容。 ...)</descrpition> \
+                    <keywords>(... 根据上下文信息生成关于该Repository合适的中文关键字。关键词之间应以逗号隔开。 ...)</keywords> \
+                    </Repository> ... ( ... one or more repositories ...)\
+                    </Repositories>```"}
+        ]
+
+    async def aget_appropriate_repositories(self, documents: List[str], requirement: str, distances: List[float] | None = None, timeout: float | None = None) -> str:
         """通过LLM评估并选择能够解决需求的Repositories，并按XML格式进行输出内容。
+        异步调用，取消时会中断与LLM的连接。
 
         Args:
             documents (List[str]): 一至多个文档的内容（对原始长文本总结生成的内容）
             requirement (str): 对问题或需求的描述
+            distances (List[float] | None, optional): 文档与检索内容的向量距离，用于在Token预算内优先保留更相关的文档. Defaults to None.
+            timeout (float | None, optional): 调用LLM的超时时间（秒）. Defaults to None，即使用初始化时设置的超时时间.
 
         Returns:
             str: 对一至多个Repositories的描述信息
         """
-        documents_content = "\n".join(
-            [parse.xml_message_pre_process(doc) for doc in documents])
-        chat_completion = self.llm.chat.completions.create(
+        # 打包检索结果时需要进行分词计算，在线程中进行避免阻塞事件循环
+        messages = await asyncio.to_thread(
+            self.get_appropriate_repositories_messages, documents, requirement, distances)
+        chat_completion = await self.get_async_llm().chat.completions.create(
             model=self.model,
-            messages=[
-                {"role": "system",
-                    "content": "首先，你需要对这些Repositories进行分析，理解它们实现的功能以及发现它们可能的应用场景。\
-                        最后，能够根据我的提问或要求，对这些Repositories进行评估，从中选择并按格式输出那些能够解决我的问题、达到我的要求的、合适的Repositories。\
-                        如果不存在任何的Repository或者没有合适的Repository，则只需返回'```xml<Repositories></Repositories>```'。"},
-                {"role": "user",
-                    "content": f"<Repositories>(... nothing ...)</Repositories>"},
-                {"role": "assistant",
-                    "content": f"```xml<Repositories></Repositories>```"},
-                {"role": "user",
-                    "content": f"<Repositories>(... {documents_content} ...)</Repositories>"},
-                {"role": "assistant",
-                    "content": "好的，我已经对这些Repositories都进行分析，并且充分地理解它们实现的功能以及发现它们可能的应用场景。具体如下： \
-                        ```xml<Repositories> \
-                        <Repository> \
-                        <name>(该Repository的名称)</name> \
-                        <owner>(该Repository的作者)</owner> \
-                        <url>(该Repository的Github链接)</url> \
-                        <descrpition>(... 结合提供文档信息进行分析，生成一段对于该Repository描述，描述必须包括其实现的功能、适用的应用场景等具有关键性、相关性的内容。 ...)</descrpition> \
-                        <keywords>(... 根据提供文档信息生成关于该Repository合适的中文关键字。关键词之间应以逗号隔开。 ...)</keywords> \
-                        </Repository> ... ( ... one or more repositories ...)\
-                        </Repositories>```"},
-                {"role": "user",
-                    "content": f"我的提问或要求是：{requirement}， \
-                        你需要从这些Repositories中选择并按格式输出那些能够解决我的问题、达到我的要求的、合适的Repositories。回复的内容格式如下：\
-                        ```xml<Repositories> \
-                        <Repository> \
-                        <name>(该Repository的名称)</name> \
-                        <owner>(该Repository的作者)</owner> \
-                        <url>(该Repository的Github链接)</url> \
-                        <descrpition>(... 结合上下文进行分析，生成一段对于该Repository描述，描述必须包括其实现的功能、适用的应用场景等具有关键性、相关性的内容。 ...)</descrpition> \
-                        <keywords>(... 根据上下文信息生成关于该Repository合适的中文关键字。关键词之间应以逗号隔开。 ...)</keywords> \
-                        </Repository> ... ( ... one or more repositories ...)\
-                        </Repositories>```"}
-            ]
+            timeout=timeout or self.timeout,
+            messages=messages
         )
         assistant_generate_message = chat_completion.choices[0].message.content
         return assistant_generate_message
 
-    def get_retriever_prompt(self, prompt: str) -> str:
+    def get_retriever_prompt_messages(self, prompt: str) -> List[dict]:
+        """构建将用户输入的提示词翻译成中文和英文，并且提取关键字或实体的对话内容。
+
+        Args:
+            prompt (str): 用户输入的提示词
+
+        Returns:
+            List[dict]: 对话内容
+        """
+        return [
+            {"role": "system",
+                "content": "你是一个翻译助手，能够将我输入的内容进行翻译，生成中文和英文两种翻译结果，\
+                    并且能够提取中文翻译和英语翻译两个句子中的关键词和实体信息。"},
+            {"role": "user",
+                "content": "'有哪些使用了通用大模型的应用可以用于文本转语音或语音转文本的转换？'"},
+            {"role": "assistant",
+                "content": "有哪些使用了通用大模型的应用可以用于文本转语音或语音转文本的转换？ \
+                    （大模型、文本、语音、转换、文本转语音、语音转文本） \
+                    What applications that use general large models are available for text-to-speech or speech-to-text conversion? \
+                    (large models, text, speech, text-to-speech, speech-to-text, conversion)"},
+            {"role": "user",
+                "content": "'What applications that use general large models are available for text-to-speech or speech-to-text conversion?'"},
+            {"role": "assistant",
+                "content": "有哪些使用了通用大模型的应用可以用于文本转语音或语音转文本的转换？ \
+                    （大模型、文本、语音、转换、文本转语音、语音转文本） \
+                    What applications that use general large models are available for text-to-speech or speech-to-text conversion? \
+                    (large models, text, speech, text-to-speech, speech-to-text, conversion)"},
+            {"role": "user",
+                "content": f"'{prompt}'"},
+        ]
+
+    async def aget_retriever_prompt(self, prompt: str, timeout: float | None = None) -> str:
         """将用户输入的提示词翻译成中文和英文，并且提取关键字或实体，用于向量检索。
+        异步调用，取消时会中断与LLM的连接。
 
         Args:
             prompt (str): 用户输入的提示词
+            timeout (float | None, optional): 调用LLM的超时时间（秒）. Defaults to None，即使用初始化时设置的超时时间.
 
         Returns:
             str: 用于向量检索的提示词
         """
-        chat_completion = self.llm.chat.completions.create(
+        chat_completion = await self.get_async_llm().chat.completions.create(
             model=self.model,
             temperature=0.3,
-            messages=[
-                {"role": "system",
-                    "content": "你是一个翻译助手，能够将我输入的内容进行翻译，生成中文和英文两种翻译结果，\
-                        并且能够提取中文翻译和英语翻译两个句子中的关键词和实体信息。"},
-                {"role": "user",
-                    "content": "'有哪些使用了通用大模型的应用可以用于文本转语音或语音转文本的转换？'"},
-                {"role": "assistant",
-                    "content": "有哪些使用了通用大模型的应用可以用于文本转语音或语音转文本的转换？ \
-                        （大模型、文本、语音、转换、文本转语音、语音转文本） \
-                        What applications that use general large models are available for text-to-speech or speech-to-text conversion? \
-                        (large models, text, speech, text-to-speech, speech-to-text, conversion)"},
-                {"role": "user",
-                    "content": "'What applications that use general large models are available for text-to-speech or speech-to-text conversion?'"},
-                {"role": "assistant",
-                    "content": "有哪些使用了通用大模型的应用可以用于文本转语音或语音转文本的转换？ \
-                        （大模型、文本、语音、转换、文本转语音、语音转文本） \
-                        What applications that use general large models are available for text-to-speech or speech-to-text conversion? \
-                        (large models, text, speech, text-to-speech, speech-to-text, conversion)"},
-                {"role": "user",
-                    "content": f"'{prompt}'"},
-            ]
+            timeout=timeout or self.timeout,
+            messages=self.get_retriever_prompt_messages(prompt)
         )
         assistant_generate_message = chat_completion.choices[0].message.content
-        return assistant_generate_message
\ No newline at end of file
+        return assistant_generate_message
@@ -11,7 +11,8 @@ class ZhiPuAIEmbeddingFunction(EmbeddingFunction[Documents]):
         self,
         api_key: Optional[str] = None,
         api_base: Optional[str] = "https://open.bigmodel.cn/api/paas/v4/embeddings",
-        model_name: str = "embedding-2"
+        model_name: str = "embedding-2",
+        timeout: Optional[float] = None
     ):
         try:
             import zhipuai
@@ -26,7 +27,7 @@ class ZhiPuAIEmbeddingFunction(EmbeddingFunction[Documents]):
                 "Please provide an ZhipuAI API key."
             )
 
-        self._client = ZhipuAI(api_key=api_key, base_url=api_base).embeddings
+        self._client = ZhipuAI(api_key=api_key, base_url=api_base, timeout=timeout).embeddings
         self._model_name = model_name
 
     def __call__(self, input: Documents) -> Embeddings:
@@ -1,22 +1,93 @@
+from __future__ import annotations
+
 import os
 import json
 import glob
 import time
 import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
+from functools import cached_property
+from typing import TYPE_CHECKING
 from pydantic import BaseModel, Field
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from service.chat_start_github import ChatStarGithub
-from service.util import github, parse
-from chromadb import Collection
-from chromadb import PersistentClient as PersistentChroma
-from chromadb.utils.embedding_functions.openai_embedding_function import OpenAIEmbeddingFunction
-from embeding_functions.zhipu_embeding_function import ZhiPuAIEmbeddingFunction
-from openai import OpenAI, BadRequestError
+from service.chat_start_github import ChatStarGithub, SUMMARIZE_PROMPT_VERSION
+from service.util import github, parse, summary_store
+from service.util.deadline import Deadline
 from fastapi.responses import JSONResponse
 
-app = FastAPI()
+# 优化：chromadb、openai、zhipuai 等依赖导入耗时较长，只在选择使用时才进行导入，加快服务的启动速度。
+if TYPE_CHECKING:
+    from chromadb import Collection
+    from chromadb.api.types import EmbeddingFunction
+    from openai import AsyncOpenAI, OpenAI
+    from vector_engines.numpy_vector_engine import NumpyVectorCollection
+
+# 向量数据库的预热状态，预热完成后首次检索无需再加载向量数据库
+warm_up_status = {"ready": False, "message": "Vector collection is warming up."}
+# 后台进行预热的任务
+warm_up_task: asyncio.Task | None = None
+
+
+def load_settings() -> None:
+    """获取本地配置初始化全局设置"""
+    global setting_persistent
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    settings_path = os.path.join(current_dir, "settings.json")
+    if os.path.exists(settings_path):
+        with open(settings_path, "r") as f:
+            setting_json_str = f.read()
+        setting_persistent = setting_persistent.model_validate_json(
+            setting_json_str)
+
+
+def warm_up_vector_collection(settings: Settings) -> None:
+    """预先打开并加载指定设置的向量数据库"""
+    try:
+        if not (settings.warm_up_on_startup and settings.github_token):
+            message = "Vector collection is not configured to warm up."
+        else:
+            start_time = time.time()
+            collection = settings.vector_collection
+            if settings.vector_backend == "numpy":
+                collection.warm_up()
+            else:
+                # 使用已存储的向量进行一次查询，加载 HNSW 索引且不会调用嵌入模型API
+                data = collection.get(limit=1, include=["embeddings"])
+                if data["embeddings"] is not None and len(data["embeddings"]) > 0:
+                    collection.query(
+                        query_embeddings=[list(data["embeddings"][0])], n_results=1)
+            # 预先创建LLM客户端和加载分词器，首次检索时无需在事件循环中进行
+            settings.chat_client.warm_up()
+            message = f"Vector collection warmed up in {time.time() - start_time:.2f}s."
+    except Exception as e:
+        # 预热失败不影响服务，检索时会重新加载向量数据库
+        print(f"Error occurred: {e}")  # 输出具体的错误信息
+        message = f"Vector collection failed to warm up: {e}"
+    print(message)
+    # 预热期间设置被再次保存时，由新设置的预热更新状态
+    if settings is setting_persistent:
+        warm_up_status.update(ready=True, message=message)
+
+
+def start_warm_up_vector_collection() -> None:
+    """重置预热状态，并在后台预热当前设置的向量数据库，不阻塞服务"""
+    global warm_up_task
+    warm_up_status.update(ready=False, message="Vector collection is warming up.")
+    warm_up_task = asyncio.create_task(
+        asyncio.to_thread(warm_up_vector_collection, setting_persistent))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_settings()
+    start_warm_up_vector_collection()
+    yield
+    warm_up_task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 配置 CORS 中间件
 app.add_middleware(
@@ -45,63 +116,129 @@ class Settings(BaseModel):
     directory_path: str = Field(default="static/repo_md")
     # 检索择优限制数量
     retriever_n_results: int = Field(default=10)
+    # 评估与选择时检索结果的Token预算
+    rerank_token_budget: int = Field(default=4000)
+    # 评估与选择时每个检索结果描述内容的Token上限
+    rerank_description_max_tokens: int = Field(default=200)
+    # 向量数据库的类型，可选 chroma 或 numpy
+    vector_backend: str = Field(default="chroma")
+    # numpy 向量数据库的存储精度，可选 float32、float16、int8
+    vector_dtype: str = Field(default="float32")
 
-    @property
+    # 总结内容的共享存储目录，所有用户Star的项目共用，相同README的项目只需总结一次
+    summary_store_path: str = Field(default="static/summary_store")
+    # 每次调用LLM的超时时间（秒）
+    llm_timeout: float = Field(default=120.0)
+    # 每次调用嵌入模型API的超时时间（秒），避免检索线程被无响应的请求一直占用
+    embedding_timeout: float = Field(default=30.0)
+    # 每次检索请求的截止时间（秒），超时的阶段会降级处理
+    search_deadline_seconds: float = Field(default=60.0)
+    # 生成检索提示词阶段占检索请求时间的比例
+    search_rewrite_budget_ratio: float = Field(default=0.2)
+    # 向量检索阶段占检索请求时间的比例，剩余的时间用于LLM评估与选择
+    search_retrieval_budget_ratio: float = Field(default=0.2)
+    # 是否在生成检索提示词的同时使用原始的提问内容进行检索
+    speculative_retrieval: bool = Field(default=True)
+    # 是否在得到生成的提示词的检索结果之前，就使用原始提问内容的检索结果开始评估与选择；
+    # 关闭时只在两次检索结果的重合度确认达到阈值后才发起评估与选择请求，不会产生被取消的LLM请求
+    speculative_rerank: bool = Field(default=True)
+    # 两次检索结果的重合度不低于该值时，直接使用原始提问内容的检索结果进行评估与选择；
+    # 低于该值时会取消已开始的评估与选择请求，但已发送的提示词Token仍会计费，阈值越高浪费的Token可能越多
+    speculative_overlap_threshold: float = Field(default=0.6)
+    # 是否在服务启动时预热向量数据库
+    warm_up_on_startup: bool = Field(default=True)
+
+    @cached_property
     def github_login_username(self) -> str:
         """Return username of the auth github"""
         return github.get_username(self.github_token)
 
-    @property
+    @cached_property
     def llm(self) -> OpenAI:
         """Return llm."""
+        from openai import OpenAI
         return OpenAI(api_key=self.llm_api_key, base_url=self.llm_api_base)
 
-    @property
+    @cached_property
+    def async_llm(self) -> AsyncOpenAI:
+        """Return async llm."""
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=self.llm_api_key, base_url=self.llm_api_base)
+
+    @cached_property
     def chat_client(self) -> ChatStarGithub:
         """Return chat client."""
-        return ChatStarGithub(llm=self.llm, model=self.llm_model_name)
+        return ChatStarGithub(llm=self.llm, model=self.llm_model_name,
+                              context_token_budget=self.rerank_token_budget,
+                              description_max_tokens=self.rerank_description_max_tokens,
+                              async_llm=self.async_llm, timeout=self.llm_timeout)
 
     @property
-    def chroma_collection(self) -> Collection:
-        """Return a chroma collection"""
-        # 选择使用的嵌入模型
+    def embedding_function_name(self) -> str:
+        """Return name of the embedding function, used to isolate vectors of different embedding models."""
         if not (self.embedding_api_base and self.embedding_api_key and self.embedding_model_name):
-            embedding_function = None
-            embedding_function_name = 'chroma_embedding'
+            return 'chroma_embedding'
         elif "bigmodel" in self.embedding_api_base:
-            embedding_function = ZhiPuAIEmbeddingFunction(
+            return 'zhipuai_embedding'
+        return 'openai_embedding'
+
+    @cached_property
+    def embedding_function(self) -> EmbeddingFunction:
+        """Return embedding function."""
+        # 选择使用的嵌入模型
+        if self.embedding_function_name == 'zhipuai_embedding':
+            from embeding_functions.zhipu_embeding_function import ZhiPuAIEmbeddingFunction
+            return ZhiPuAIEmbeddingFunction(
                 api_key=self.embedding_api_key,
                 api_base=self.embedding_api_base,
-                model_name=self.embedding_model_name
+                model_name=self.embedding_model_name,
+                timeout=self.embedding_timeout
             )
-            embedding_function_name = 'zhipuai_embedding'
-        else:
-            embedding_function = OpenAI(
+        elif self.embedding_function_name == 'openai_embedding':
+            from embeding_functions.openai_embeding_function import OpenAIEmbeddingFunction
+            return OpenAIEmbeddingFunction(
                 api_key=self.embedding_api_key,
                 api_base=self.embedding_api_base,
-                model_name=self.embedding_model_name
+                model_name=self.embedding_model_name,
+                timeout=self.embedding_timeout
             )
-            embedding_function_name = 'openai_embedding'
+        # Chroma默认使用的是all-MiniLM-L6-v2模型来进行 embeddings
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+        return DefaultEmbeddingFunction()
+
+    @cached_property
+    def chroma_collection(self) -> Collection:
+        """Return a chroma collection"""
+        from chromadb import PersistentClient as PersistentChroma
         # 使用 Chroma 作为本地持久化的向量数据库
-        chroma_client = PersistentChroma(path=f"vector/chat-github-star/{embedding_function_name}")
+        chroma_client = PersistentChroma(path=f"vector/chat-github-star/{self.embedding_function_name}")
         collection = chroma_client.create_collection(# name="embeddings", 优化：按照向量集合来隔离不同用户Star的项目信息，去除后续检索时的筛选步骤，提高检索效率。
                                                     name=self.github_login_username,
                                                     get_or_create=True,
                                                     # Chroma默认使用的是all-MiniLM-L6-v2模型来进行 embeddings
                                                     # 这里使用嵌入模型API对文本进行向量计算
-                                                    embedding_function=embedding_function)
+                                                    embedding_function=self.embedding_function)
         return collection
 
+    @cached_property
+    def numpy_collection(self) -> NumpyVectorCollection:
+        """Return a numpy vector collection"""
+        from vector_engines.numpy_vector_engine import NumpyVectorCollection
+        return NumpyVectorCollection(path=f"vector/chat-github-star-numpy/{self.embedding_function_name}/{self.github_login_username}",
+                                     embedding_function=self.embedding_function,
+                                     dtype=self.vector_dtype)
+
+    @property
+    def vector_collection(self) -> Collection | NumpyVectorCollection:
+        """Return the vector collection of the selected vector backend"""
+        # 优化：用户Star的项目数量通常只有几百至几千个，使用 NumPy 进行精确的暴力检索即可，启动和查询都比 Chroma 更快。
+        if self.vector_backend == "numpy":
+            return self.numpy_collection
+        return self.chroma_collection
+
 
-# 获取本地配置初始化全局设置
+# 全局设置，在服务启动时从本地配置中加载
 setting_persistent = Settings()
-current_dir = os.path.dirname(os.path.abspath(__file__))
-settings_path = os.path.join(current_dir, "settings.json")
-if os.path.exists(settings_path):
-    with open(settings_path, "r") as f:
-        setting_json_str = f.read()
-    setting_persistent = setting_persistent.model_validate_json(
-        setting_json_str)
 
 
 @app.post("/save-settings")
@@ -111,12 +248,16 @@ async def save_settings(settings: Settings):
         # 获取当前路径
         current_dir = os.path.dirname(os.path.abspath(__file__))
         settings_path = os.path.join(current_dir, "settings.json")
+        # 只更新请求中提交的字段，页面上没有的设置（如向量数据库的类型）保持原有的值
+        setting_json_str = setting_persistent.model_validate(
+            {**setting_persistent.model_dump(), **settings.model_dump(exclude_unset=True)}).model_dump_json()
         # 保存设置到 settings.json 文件
         with open(settings_path, "w") as f:
-            setting_json_str = settings.model_dump_json()
             f.write(setting_json_str)
         setting_persistent = setting_persistent.model_validate_json(
             setting_json_str)
+        # 新的设置没有已加载的向量数据库和LLM客户端，需要重新预热
+        start_warm_up_vector_collection()
         return JSONResponse({"message": "Settings saved successfully!", "success": 1})
     except Exception as e:
         print(f"Error occurred: {e}")  # 输出具体的错误信息
@@ -139,6 +280,21 @@ async def get_settings():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def persist_vector_collection() -> None:
+    """将 numpy 向量数据库中新增的向量写入快照，Chroma 会自动持久化"""
+    global setting_persistent
+    if setting_persistent.vector_backend == "numpy":
+        setting_persistent.numpy_collection.persist()
+
+
+@app.get("/ready")
+async def ready():
+    # 向量数据库预热完成后返回200，否则返回503
+    return JSONResponse({"message": warm_up_status["message"], "ready": warm_up_status["ready"],
+                         "success": int(warm_up_status["ready"])},
+                        status_code=200 if warm_up_status["ready"] else 503)
+
+
 @app.get("/init-github-data")
 def init_github_readme():
     global setting_persistent
@@ -159,61 +315,98 @@ def init_github_readme():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def summarize_repository(md_file_name: str, md_content: str, last_sumarize: str | None = None) -> tuple[str, list[float]]:
+    """获取文档对应Repository的总结内容和向量，优先从共享存储中查找，不存在时通过LLM生成并存储
+
+    Args:
+        md_file_name (str): 文档的文件名
+        md_content (str): 文档内容
+        last_sumarize (str | None, optional): 已存在但不符合要求的总结内容，不为空时在此基础上重新生成. Defaults to None.
+
+    Returns:
+        tuple[str, list[float]]: 总结内容和向量
+    """
+    global setting_persistent
+    # 优化：按照README内容、总结模型和提示词版本从共享存储中查找总结内容，相同README的项目在所有用户之间只需总结一次。
+    summary_key = summary_store.get_summary_key(
+        md_content, model=setting_persistent.llm_model_name, prompt_version=SUMMARIZE_PROMPT_VERSION)
+    summary_entry = summary_store.get_summary_entry(
+        setting_persistent.summary_store_path, summary_key)
+    if summary_entry:
+        summarize = summary_entry.get_summary(md_content)
+        print(f"已存在相同README的总结内容，不会重复进行总结，当前文件：{md_file_name}")
+    else:
+        summarize = last_sumarize or setting_persistent.chat_client.get_summarize(
+            md_content)
+        while not parse.repository_summary_vaild(summarize):
+            # 生成的总结不充分，需重新生成
+            print(
+                f"生成的内容不符合要求，需要LLM重新生成总结，当前文件：{md_file_name}"
+            )
+            summarize = setting_persistent.chat_client.get_summarize_retry(
+                md_content, last_sumarize=summarize)
+        summary_entry = summary_store.SummaryEntry(
+            summary=summarize,
+            source=summary_store.get_repository_source(
+                parse.get_md_repository_fields(md_content)),
+            model=setting_persistent.llm_model_name,
+            prompt_version=SUMMARIZE_PROMPT_VERSION)
+    # 总结内容和嵌入模型都相同时复用已计算的向量；使用嵌入函数计算原始向量，避免存储向量数据库量化后的近似值
+    embedding_key = summary_store.get_embedding_key(
+        f"{setting_persistent.embedding_function_name}/{setting_persistent.embedding_model_name}", summarize)
+    embedding = summary_entry.embeddings.get(embedding_key)
+    if embedding is None:
+        embedding = [float(value) for value in setting_persistent.embedding_function([summarize])[0]]
+        summary_entry.embeddings[embedding_key] = embedding
+        summary_store.save_summary_entry(
+            setting_persistent.summary_store_path, summary_key, summary_entry)
+    return summarize, embedding
+
+
 @ app.get("/init-chroma-collection")
 def init_chroma_collection():
     global setting_persistent
+    from openai import BadRequestError
     try:
         # 数据库存储向量和元数据
         md_files_dict = parse.get_md_files_dict(
             setting_persistent.directory_path)
+        vector_collection = setting_persistent.vector_collection
         for index, (md_file_name, md_content) in enumerate(md_files_dict.items(), start=1):
             print(
                 f"({index}/{len(md_files_dict.keys())}) - 文件正在进行压缩和向量计算，当前文件：{md_file_name}"
             )
-            result = setting_persistent.chroma_collection.get(ids=md_file_name,
-                                                            # 优化：检索时增加where条件会增加较多的耗时，所以这里在遍历文件时采用模糊匹配即可，后续检索时再增加条件筛选。
-                                                            #   where={
-                                                            #       "who_starred": {
-                                                            #           "$eq": setting_persistent.github_login_username
-                                                            #       }
-                                                            #   }
-                                                            )
+            result = vector_collection.get(ids=md_file_name,
+                                         # 优化：检索时增加where条件会增加较多的耗时，所以这里在遍历文件时采用模糊匹配即可，后续检索时再增加条件筛选。
+                                         #   where={
+                                         #       "who_starred": {
+                                         #           "$eq": setting_persistent.github_login_username
+                                         #       }
+                                         #   }
+                                         )
             # 不重复计算已存在的向量
             if result['ids']:
                 summarize = result["documents"][0]
                 is_vaild = parse.repository_summary_vaild(summarize)
                 if not is_vaild:
-                    while not is_vaild:
-                        # 生成的总结不充分，需重新生成
-                        print(
-                            f"生成的内容不符合要求，需要LLM重新生成总结，当前文件：{md_file_name}"
-                        )
-                        summarize = setting_persistent.chat_client.get_summarize_retry(
-                            md_content, last_sumarize=summarize)
-                        is_vaild = parse.repository_summary_vaild(summarize)
-                    setting_persistent.chroma_collection.add(documents=summarize, ids=md_file_name, metadatas={
+                    summarize, embedding = summarize_repository(
+                        md_file_name, md_content, last_sumarize=summarize)
+                    vector_collection.add(documents=summarize, ids=md_file_name, metadatas={
                         "md_file_source_path": md_file_name,
                         "who_starred": setting_persistent.github_login_username
-                    })
+                    }, embeddings=[embedding])
                 else:
                     print(
                         f"({index}/{len(md_files_dict.keys())}) - 文件已向量化，不会重复进行向量计算，当前文件：{md_file_name}"
                     )
             else:
                 try:
-                    summarize = setting_persistent.chat_client.get_summarize(
-                        md_content)
-                    while not parse.repository_summary_vaild(summarize):
-                        # 生成的总结不充分，需重新生成
-                        print(
-                            f"生成的内容不符合要求，需要LLM重新生成总结，当前文件：{md_file_name}"
-                        )
-                        summarize = setting_persistent.chat_client.get_summarize_retry(
-                            md_content, last_sumarize=summarize)
-                    setting_persistent.chroma_collection.add(documents=summarize, ids=md_file_name, metadatas={
+                    summarize, embedding = summarize_repository(
+                        md_file_name, md_content)
+                    vector_collection.add(documents=summarize, ids=md_file_name, metadatas={
                         "md_file_source_path": md_file_name,
                         "who_starred": setting_persistent.github_login_username
-                    })
+                    }, embeddings=[embedding])
                     print(
                         f"({index}/{len(md_files_dict.keys())}) - 文件向量计算已完成：{md_file_name} "
                     )
@@ -221,49 +414,218 @@ def init_chroma_collection():
                     print(
                         f"({index}/{len(md_files_dict.keys())}) - 向量计算文件：{md_file_name} 时发生了一个错误：{e.message}"
                     )
+        persist_vector_collection()
         return JSONResponse({"message": "Chroma-collection inited successfully!", "success": 1})
     except Exception as e:
         print(f"Error occurred: {e}")  # 输出具体的错误信息
+        # 保存已完成向量计算的内容，重新初始化时不会重复计算
+        persist_vector_collection()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/search")
-def search(requirement: Requirement):
+@app.get("/import-chroma-collection")
+def import_chroma_collection():
     global setting_persistent
-    print(
-        f"正在检索与之相关的Repositories：{requirement.detail}"
+    try:
+        # 将 Chroma 中已计算的向量导入到 numpy 向量数据库，无需重新进行向量计算
+        numpy_collection = setting_persistent.numpy_collection
+        numpy_collection.import_from_chroma(
+            setting_persistent.chroma_collection)
+        print(f"已从Chroma导入{numpy_collection.count()}个向量：{numpy_collection.path}")
+        return JSONResponse({"message": "Chroma-collection imported successfully!", "success": 1})
+    except Exception as e:
+        print(f"Error occurred: {e}")  # 输出具体的错误信息
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/export-chroma-collection")
+def export_chroma_collection():
+    global setting_persistent
+    try:
+        # 将 numpy 向量数据库中的向量导出到 Chroma
+        numpy_collection = setting_persistent.numpy_collection
+        numpy_collection.export_to_chroma(setting_persistent.chroma_collection)
+        print(f"已导出{numpy_collection.count()}个向量到Chroma：{numpy_collection.path}")
+        return JSONResponse({"message": "Chroma-collection exported successfully!", "success": 1})
+    except Exception as e:
+        print(f"Error occurred: {e}")  # 输出具体的错误信息
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def query_vector_collection(query_text: str) -> dict:
+    """检索向量相关的数据，返回n_results个最相关的数据"""
+    return setting_persistent.vector_collection.query(
+        query_texts=[
+            query_text
+        ],
+        n_results=setting_persistent.retriever_n_results,
+        # 优化：在初始化时按照向量集合来隔离不同用户Star的项目信息，去除后续检索时的条件查询步骤，提高检索效率。
+        # 条件查询，查询元数据中的who_starred字段，确保不会搜索到其他用户star的repository
+        # where={
+        #     "who_starred": {
+        #         "$eq": setting_persistent.github_login_username
+        #     }
+        # }
     )
+
+
+async def rewrite_requirement(chat_client: ChatStarGithub, requirement: str, timeout: float) -> str:
+    """生成用于向量检索的提示词，超时后降级为使用原始的提问内容"""
+    from openai import APITimeoutError
     try:
-        # 检索向量相关的数据，返回n_results个最相关的数据
-        retriever_prompt = setting_persistent.chat_client.get_retriever_prompt(
-            requirement.detail)
-        relative_documnets = setting_persistent.chroma_collection.query(
-            query_texts=[
-                retriever_prompt
-            ],
-            n_results=setting_persistent.retriever_n_results,
-            # 优化：在初始化时按照向量集合来隔离不同用户Star的项目信息，去除后续检索时的条件查询步骤，提高检索效率。
-            # 条件查询，查询元数据中的who_starred字段，确保不会搜索到其他用户star的repository
-            # where={
-            #     "who_starred": {
-            #         "$eq": setting_persistent.github_login_username
-            #     }
-            # }
-        )["documents"][0]
-        print(f"检索到与之相关的Repositories：{relative_documnets}")
-        print(f"检索完成！等待LLM评估与选择的最终结果......")
-        result = {}
-        # 将检索到的信息交给 LLM 进行评估和选择
-        if relative_documnets and len(relative_documnets) > 1:
-            appropriate_repositories = setting_persistent.chat_client.get_appropriate_repositories(
-                documents=relative_documnets, requirement=requirement.detail)
+        return await asyncio.wait_for(
+            chat_client.aget_retriever_prompt(requirement, timeout=timeout), timeout=timeout)
+    except (asyncio.TimeoutError, APITimeoutError):
+        print(f"LLM生成检索提示词超时，使用原始的提问内容进行检索：{requirement}")
+        return requirement
+
+
+async def retrieve_repositories(query_text: str, timeout: float) -> dict | None:
+    """进行向量检索，超时后返回None"""
+    try:
+        return await asyncio.wait_for(
+            asyncio.to_thread(query_vector_collection, query_text), timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"向量检索超时：{query_text}")
+        return None
+
+
+async def rerank_repositories(chat_client: ChatStarGithub, requirement: str, documents: list[str],
+                              distances: list[float], deadline: Deadline) -> dict:
+    """将检索到的信息交给 LLM 进行评估和选择，超时后降级为直接返回向量检索的结果"""
+    from openai import APITimeoutError
+    result = {}
+    if documents and len(documents) > 1:
+        try:
+            rerank_timeout = deadline.remaining()
+            appropriate_repositories = await asyncio.wait_for(
+                chat_client.aget_appropriate_repositories(
+                    documents=documents, requirement=requirement, distances=distances, timeout=rerank_timeout),
+                timeout=rerank_timeout)
             result = parse.repositories_xml2json_out_parse(
                 xml_content=parse.xml_message_pre_process(appropriate_repositories))
+        except (asyncio.TimeoutError, APITimeoutError):
+            # 降级：直接返回向量检索的结果，不再经过LLM评估与选择
+            print("LLM评估与选择超时，直接返回向量检索的结果")
+            result = parse.repository_summaries_json_out_parse(documents)
+    return result
+
+
+def merge_query_results(*query_results: dict) -> tuple[list[str], list[float]]:
+    """合并多次向量检索的结果，相同的文档保留最小的向量距离，并按向量距离排序"""
+    merged = {}
+    for query_result in query_results:
+        for id, document, distance in zip(query_result["ids"][0], query_result["documents"][0], query_result["distances"][0]):
+            if id not in merged or distance < merged[id][1]:
+                merged[id] = (document, distance)
+    ordered = sorted(merged.values(), key=lambda item: item[1])
+    return [document for document, _ in ordered], [distance for _, distance in ordered]
+
+
+def retrieve_task_exception(task: asyncio.Task) -> None:
+    """获取已结束任务的异常，避免被取消或忽略的任务出现"Task exception was never retrieved"的警告"""
+    if not task.cancelled():
+        task.exception()
+
+
+async def search_repositories(requirement: str) -> dict:
+    """在截止时间内完成检索，各个阶段超时后降级处理，保证请求能够及时返回"""
+    global setting_persistent
+    deadline = Deadline(setting_persistent.search_deadline_seconds)
+    # 首次获取时会导入 openai 并创建客户端，在线程中进行避免阻塞事件循环
+    chat_client = await asyncio.to_thread(lambda: setting_persistent.chat_client)
+    retrieval_ratio = setting_persistent.search_retrieval_budget_ratio
+    rewrite_task = asyncio.create_task(rewrite_requirement(
+        chat_client, requirement, deadline.stage_timeout(setting_persistent.search_rewrite_budget_ratio)))
+    speculative_query_result, speculative_rerank_task = None, None
+    try:
+        if setting_persistent.speculative_retrieval:
+            # 优化：在LLM生成检索提示词的同时，使用原始的提问内容进行检索并开始评估与选择，
+            # 生成的提示词检索结果与之相近时直接使用该评估结果，减少一次LLM请求的等待时间。
+            speculative_query_result = await retrieve_repositories(
+                requirement, deadline.stage_timeout(retrieval_ratio))
+            if speculative_query_result and setting_persistent.speculative_rerank:
+                speculative_rerank_task = asyncio.create_task(rerank_repositories(
+                    chat_client, requirement, speculative_query_result["documents"][0],
+                    speculative_query_result["distances"][0], deadline))
+        try:
+            retriever_prompt = await rewrite_task
+        except Exception as e:
+            # 降级：生成检索提示词失败（如连接错误）时，使用原始提问内容的检索结果
+            if not speculative_query_result:
+                raise
+            print(f"LLM生成检索提示词失败，使用原始提问内容的检索结果：{e}")
+            retriever_prompt = requirement
+        if speculative_query_result and retriever_prompt == requirement:
+            query_result = speculative_query_result
+        else:
+            query_result = await retrieve_repositories(
+                retriever_prompt, deadline.stage_timeout(retrieval_ratio))
+        if query_result is None:
+            if not speculative_query_result:
+                print("向量检索超时，没有可返回的结果")
+                return {}
+            query_result = speculative_query_result
+        if speculative_query_result:
+            speculative_ids = set(speculative_query_result["ids"][0])
+            rewrite_ids = set(query_result["ids"][0])
+            overlap = len(speculative_ids & rewrite_ids) / \
+                max(len(rewrite_ids), 1)
+            if overlap >= setting_persistent.speculative_overlap_threshold:
+                print(f"检索结果重合度为{overlap:.2f}，使用原始提问内容的检索结果进行评估与选择")
+                if speculative_rerank_task:
+                    return await speculative_rerank_task
+                relative_documnets = speculative_query_result["documents"][0]
+                relative_distances = speculative_query_result["distances"][0]
+            else:
+                print(f"检索结果重合度为{overlap:.2f}，合并检索结果后重新进行评估与选择")
+                if speculative_rerank_task:
+                    speculative_rerank_task.cancel()
+                relative_documnets, relative_distances = merge_query_results(
+                    speculative_query_result, query_result)
+        else:
+            relative_documnets = query_result["documents"][0]
+            relative_distances = query_result["distances"][0]
+        print(f"检索到与之相关的Repositories：{relative_documnets}")
+        print(f"检索完成！等待LLM评估与选择的最终结果......")
+        return await rerank_repositories(chat_client, requirement, relative_documnets, relative_distances, deadline)
+    finally:
+        # 检索被取消（如客户端断开连接）时，同时取消正在进行的LLM请求，并获取被取消或忽略的任务的异常
+        for task in [rewrite_task, speculative_rerank_task]:
+            if task:
+                if not task.done():
+                    task.cancel()
+                task.add_done_callback(retrieve_task_exception)
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """等待客户端断开连接"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(0.5)
+
+
+@app.post("/search")
+async def search(requirement: Requirement, request: Request):
+    print(
+        f"正在检索与之相关的Repositories：{requirement.detail}"
+    )
+    search_task = asyncio.create_task(search_repositories(requirement.detail))
+    disconnect_task = asyncio.create_task(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({search_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not search_task.done():
+            # 优化：客户端断开连接后取消检索，同时中断正在进行的LLM请求，避免浪费计算资源和调用额度。
+            search_task.cancel()
+            print(f"客户端已断开连接，取消检索：{requirement.detail}")
+            return JSONResponse({"message": "Client disconnected.", "success": 0}, status_code=499)
+        result = search_task.result()
         print(f"LLM评估与选择的最终结果（可能为空）：{result}")
         return result
     except Exception as e:
         print(f"Error occurred: {e}")  # 输出具体的错误信息
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        disconnect_task.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+from . import parse
+
+# 本地分词器使用的编码，与主流的 OpenAI 接口规范模型的分词方式接近
+TOKENIZER_ENCODING_NAME = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> Optional[Callable[[str], List[int]]]:
+    """获取本地分词器，未安装 tiktoken 或编码文件不可用时返回 None
+
+    Returns:
+        Optional[Callable[[str], List[int]]]: 将文本编码为 Token 列表的函数
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING_NAME).encode
+    except Exception as e:
+        print(f"本地分词器不可用，将使用估算的方式计算Token数量：{e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """计算文本的Token数量
+
+    Args:
+        text (str): 文本内容
+
+    Returns:
+        int: Token数量，分词器不可用时按每个中日韩字符1个Token、其他字符每4个1个Token进行估算
+    """
+    tokenizer = get_tokenizer()
+    if tokenizer:
+        return len(tokenizer(text))
+    cjk_count = sum(1 for char in text if "\u2e80" <= char <= "\u9fff")
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """将文本截断到不超过指定的Token数量
+
+    Args:
+        text (str): 文本内容
+        max_tokens (int): 最大Token数量
+
+    Returns:
+        str: 截断后的文本，发生截断时以"..."结尾
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    # 二分查找不超过限制的最长前缀，避免依赖分词器的解码功能
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) < max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + "..."
+
+
+def compact_repository_summary(summary: str, description_max_tokens: int) -> str:
+    """将对repository的总结内容压缩为只包含名称、作者、链接、关键字和截断后描述的XML
+
+    Args:
+        summary (str): repository的总结内容
+        description_max_tokens (int): 描述内容的最大Token数量
+
+    Returns:
+        str: 压缩后的XML格式的repository信息
+    """
+    fields = parse.repository_summary_fields(summary)
+    description = truncate_tokens(
+        fields["description"], description_max_tokens)
+    return (f"<Repository><name>{fields['name']}</name><owner>{fields['owner']}</owner>"
+            f"<url>{fields['url']}</url><keywords>{fields['keywords']}</keywords>"
+            f"<description>{description}</description></Repository>")
+
+
+def _shingles(text: str, size: int = 3) -> set[str]:
+    # 使用字符级别的切片，同时适用于中文和英文的描述内容
+    text = "".join(text.lower().split())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def is_near_duplicate(fields: dict[str, str], packed_fields: List[dict[str, str]], threshold: float) -> bool:
+    """判断repository的总结内容是否与已选择的内容重复或高度相似
+
+    Args:
+        fields (dict[str, str]): 待判断的repository的总结内容的标签和文本
+        packed_fields (List[dict[str, str]]): 已选择的repository的总结内容的标签和文本
+        threshold (float): 描述内容相似度（Jaccard）的阈值，大于等于该值视为重复
+
+    Returns:
+        bool: 重复返回True否则返回False
+    """
+    shingles = _shingles(fields["description"])
+    for packed in packed_fields:
+        if fields["url"] and fields["url"] == packed["url"]:
+            return True
+        packed_shingles = _shingles(packed["description"])
+        similarity = len(shingles & packed_shingles) / \
+            max(len(shingles | packed_shingles), 1)
+        if similarity >= threshold:
+            return True
+    return False
+
+
+def build_rerank_context(documents: List[str], distances: Optional[List[float]] = None,
+                        token_budget: int = 4000, description_max_tokens: int = 200,
+                        duplicate_threshold: float = 0.85) -> str:
+    """在Token预算内按相似度从高到低打包检索到的repository，用于LLM评估与选择
+
+    Args:
+        documents (List[str]): 一至多个文档的内容（对原始长文本总结生成的内容）
+        distances (Optional[List[float]], optional): 文档与检索内容的向量距离，越小越相似. Defaults to None，即保持检索返回的顺序.
+        token_budget (int, optional): 打包后内容的最大Token数量. Defaults to 4000.
+        description_max_tokens (int, optional): 每个repository描述内容的最大Token数量. Defaults to 200.
+        duplicate_threshold (float, optional): 视为重复内容的描述相似度阈值. Defaults to 0.85.
+
+    Returns:
+        str: 打包后的repositories信息，每行一个repository
+    """
+    order = range(len(documents))
+    if distances:
+        order = sorted(order, key=lambda i: distances[i])
+    packed_fields, packed_contents = [], []
+    used_tokens = 0
+    for i in order:
+        summary = parse.xml_message_pre_process(documents[i]) or documents[i]
+        fields = parse.repository_summary_fields(summary)
+        if not (fields["name"] or fields["url"]):
+            continue
+        if is_near_duplicate(fields, packed_fields, duplicate_threshold):
+            print(f"跳过与已选择内容重复的Repository：{fields['url'] or fields['name']}")
+            continue
+        content = compact_repository_summary(summary, description_max_tokens)
+        tokens = count_tokens(content)
+        if used_tokens + tokens > token_budget:
+            # 超出预算的候选不加入，继续尝试后续更短的候选
+            continue
+        used_tokens += tokens
+        packed_fields.append(fields)
+        packed_contents.append(content)
+    print(
+        f"已打包{len(packed_contents)}/{len(documents)}个Repository，Token数量：{used_tokens}/{token_budget}")
+    return "\n".join(packed_contents)
@@ -0,0 +1,29 @@
+import time
+
+
+class Deadline:
+    """检索请求的截止时间，按比例为各个阶段分配可用的时间"""
+
+    def __init__(self, seconds: float):
+        """Init
+
+        Args:
+            seconds (float): 整个请求可用的时间（秒）
+        """
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Return the remaining seconds before the deadline, never negative."""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def stage_timeout(self, ratio: float) -> float:
+        """计算某个阶段可用的时间，前面阶段节省的时间会留给后面的阶段
+
+        Args:
+            ratio (float): 该阶段占整个请求时间的比例
+
+        Returns:
+            float: 该阶段可用的时间（秒），不超过剩余的时间
+        """
+        return min(self.seconds * ratio, self.remaining())
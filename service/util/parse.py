@@ -56,6 +56,27 @@ def repositories_xml2json_out_parse(xml_content: str, is_dumps=False) -> str | d
     return json_result
 
 
+def repository_summaries_json_out_parse(documents: list[str]) -> dict[str, list]:
+    """将检索到的repository的总结内容直接转换成Json格式，用于LLM未能及时完成评估与选择时返回检索结果
+
+    Args:
+        documents (list[str]): 一至多个repository的总结内容
+
+    Returns:
+        dict[str, list]: Json格式的数据，与repositories_xml2json_out_parse的输出格式一致
+    """
+    repositories, urls = [], set()
+    for document in documents:
+        repo_dict = repository_summary_fields(document)
+        if not repo_dict["url"] or repo_dict["url"] in urls:
+            continue
+        urls.add(repo_dict["url"])
+        repositories.append(repo_dict)
+    return {
+        "Repositories": repositories
+    }
+
+
 def xml_message_pre_process(message: str) -> str:
     """解析回复的格式化信息，获取主要内容
 
@@ -74,6 +95,69 @@ def xml_message_pre_process(message: str) -> str:
     return message
 
 
+def repository_summary_fields(content: str) -> dict[str, str]:
+    """提取对repository的总结内容中各个标签的文本，标签缺失时对应的值为空字符串
+
+    Args:
+        content (str): repository的总结内容
+
+    Returns:
+        dict[str, str]: 标签名（name、owner、url、description、keywords）和文本的键值对
+    """
+    fields = {}
+    for tag in ["name", "owner", "url", "description", "keywords"]:
+        # 兼容LLM按提示词示例生成的<descrpition>标签
+        tag_pattern = "descr(?:ip|pi)tion" if tag == "description" else tag
+        match = re.search(
+            rf"<({tag_pattern})>(.*?)</\1>", content, re.DOTALL)
+        fields[tag] = " ".join(match.group(2).split()) if match else ""
+    return fields
+
+
+def get_md_repository_fields(md_content: str) -> dict[str, str]:
+    """获取文档中Repository各个字段的内容，文档格式与github.Repository.model_dump_markdown的输出一致
+
+    Args:
+        md_content (str): 文档内容
+
+    Returns:
+        dict[str, str]: 字段名（owner、name、description、stargazers_count、url、readme_content）和内容的键值对
+    """
+    fields = ["owner", "name", "description",
+              "stargazers_count", "url", "readme_content"]
+    # 按字段顺序依次查找标题，避免readme_content中的标题被误认为字段
+    headers, position = [], 0
+    for field in fields:
+        match = re.compile(rf"^# {field} \(.*\)$\n?",
+                           re.MULTILINE).search(md_content, position)
+        if match:
+            headers.append((field, match.start(), match.end()))
+            position = match.end()
+    res = {field: "" for field in fields}
+    for i, (field, _, end) in enumerate(headers):
+        stop = headers[i + 1][1] if i + 1 < len(headers) else len(md_content)
+        res[field] = md_content[end:stop].strip()
+    return res
+
+
+def replace_repository_summary_identity(content: str, name: str, owner: str, url: str) -> str:
+    """替换对repository的总结内容中的名称、作者和链接
+
+    Args:
+        content (str): repository的总结内容
+        name (str): Repository的名称
+        owner (str): Repository的作者
+        url (str): Repository的Github链接
+
+    Returns:
+        str: 替换后的总结内容
+    """
+    for tag, value in [("name", name), ("owner", owner), ("url", url)]:
+        content = re.sub(rf"<{tag}>.*?</{tag}>",
+                         lambda _: f"<{tag}>{value}</{tag}>", content, flags=re.DOTALL)
+    return content
+
+
 def repository_summary_vaild(content: str) -> bool:
     """判断对repository的总结内容是否符合要求，需要包含要求的标签和内容
 
@@ -0,0 +1,109 @@
+import os
+import hashlib
+import tempfile
+from typing import Optional
+from pydantic import BaseModel, Field
+
+from . import parse
+
+
+class SummaryEntry(BaseModel):
+    summary: str = Field(default="", description="The summary generated by the LLM.")
+    source: str = Field(
+        default="", description="The repository (owner/name) which the summary was generated for.")
+    model: str = Field(default="", description="The name of the LLM which generated the summary.")
+    prompt_version: str = Field(
+        default="", description="The version of the prompt which generated the summary.")
+    embeddings: dict[str, list[float]] = Field(
+        default={}, description="The embeddings of the summary, keyed by the embedding model and the hash of the embedded document.")
+
+    def get_summary(self, md_content: str) -> str:
+        """获取适用于该文档对应Repository的总结内容。
+        README相同的其他Repository（如fork或镜像）复用总结内容时，会替换其中的名称、作者和链接。
+
+        Args:
+            md_content (str): 文档内容
+
+        Returns:
+            str: Repository的总结内容
+        """
+        fields = parse.get_md_repository_fields(md_content)
+        if get_repository_source(fields) == self.source:
+            return self.summary
+        return parse.replace_repository_summary_identity(
+            self.summary, name=fields["name"], owner=fields["owner"], url=fields["url"])
+
+
+def get_repository_source(fields: dict[str, str]) -> str:
+    return f"{fields['owner']}/{fields['name']}"
+
+
+def get_summary_key(md_content: str, model: str, prompt_version: str) -> str:
+    """根据规范化后的README内容、总结使用的模型和提示词版本计算总结内容的存储键
+
+    Args:
+        md_content (str): 文档内容
+        model (str): 总结使用的LLM模型的名称
+        prompt_version (str): 总结使用的提示词版本
+
+    Returns:
+        str: 总结内容的存储键
+    """
+    fields = parse.get_md_repository_fields(md_content)
+    # 规范化README内容，忽略空白字符的差异；不包含会随时间变化的Star数量等字段
+    content = " ".join(fields["readme_content"].split())
+    if not content:
+        # 没有README时无法判断内容是否相同，只在相同的Repository之间复用
+        content = f"{get_repository_source(fields)}\n{' '.join(fields['description'].split())}"
+    return hashlib.sha256(f"{model}\n{prompt_version}\n{content}".encode("utf-8")).hexdigest()
+
+
+def get_embedding_key(embedding_model: str, document: str) -> str:
+    """计算总结内容的向量的存储键，只有向量模型和文档内容都相同时才能复用向量
+
+    Args:
+        embedding_model (str): 嵌入模型的名称
+        document (str): 进行向量计算的文档内容
+
+    Returns:
+        str: 向量的存储键
+    """
+    return f"{embedding_model}:{hashlib.sha256(document.encode('utf-8')).hexdigest()}"
+
+
+def get_summary_entry_path(directory: str, key: str) -> str:
+    return os.path.join(directory, key[:2], f"{key}.json")
+
+
+def get_summary_entry(directory: str, key: str) -> Optional[SummaryEntry]:
+    """获取已存储的总结内容
+
+    Args:
+        directory (str): 总结内容的本地存储目录
+        key (str): 总结内容的存储键
+
+    Returns:
+        Optional[SummaryEntry]: 已存储的总结内容，不存在时返回None
+    """
+    file_path = get_summary_entry_path(directory, key)
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'r', encoding='utf-8') as json_file:
+        return SummaryEntry.model_validate_json(json_file.read())
+
+
+def save_summary_entry(directory: str, key: str, entry: SummaryEntry) -> None:
+    """存储总结内容，先写入临时文件再替换，避免多个用户同时初始化时读取到不完整的内容
+
+    Args:
+        directory (str): 总结内容的本地存储目录
+        key (str): 总结内容的存储键
+        entry (SummaryEntry): 总结内容
+    """
+    file_path = get_summary_entry_path(directory, key)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_fd, tmp_file_path = tempfile.mkstemp(
+        dir=os.path.dirname(file_path), suffix=".tmp")
+    with os.fdopen(tmp_fd, 'w', encoding='utf-8') as json_file:
+        json_file.write(entry.model_dump_json())
+    os.replace(tmp_file_path, file_path)
@@ -0,0 +1,317 @@
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 支持的向量存储精度，int8 按 127 倍缩放归一化后的向量进行量化
+SUPPORTED_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+INT8_SCALE = 127.0
+
+EMBEDDINGS_FILE_NAME = "embeddings.npy"
+SIDECAR_FILE_NAME = "sidecar.json"
+
+
+class NumpyVectorCollection:
+    """基于 NumPy 的进程内向量集合，接口与 chromadb 的 Collection 保持一致（get/add/query/count）。
+
+    向量以归一化后的矩阵保存在 `.npy` 文件中并通过内存映射加载，id、文档和元数据保存在 json 文件中。
+    查询时对全部向量进行精确的暴力检索，返回的 distances 为余弦距离（1 - 余弦相似度）。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding_function: Optional[Any] = None,
+        dtype: str = "float32"
+    ):
+        """Init
+
+        Args:
+            path (str): 向量集合的本地存储目录
+            embedding_function (Optional[Any], optional): 嵌入函数，与 chromadb 的 EmbeddingFunction 接口一致. Defaults to None，即使用 Chroma 默认的嵌入模型.
+            dtype (str, optional): 新建集合时向量的存储精度，可选 float32、float16、int8. Defaults to "float32".
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(
+                f"Unsupported dtype: {dtype}. Please choose one of {list(SUPPORTED_DTYPES.keys())}"
+            )
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self._embedding_function = embedding_function
+        self._dtype = dtype
+        self._matrix: Optional[np.ndarray] = None
+        self._dequantized_matrix: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict[str, Any]]] = []
+        self._id_to_index: Dict[str, int] = {}
+        # 新增的向量先缓存在内存中，调用 persist 时再写入快照，避免每次添加都重写整个文件
+        self._pending_rows: List[np.ndarray] = []
+        self._dirty = False
+        # 添加向量与查询可能在不同的线程中同时进行
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def embeddings_path(self) -> str:
+        return os.path.join(self.path, EMBEDDINGS_FILE_NAME)
+
+    @property
+    def sidecar_path(self) -> str:
+        return os.path.join(self.path, SIDECAR_FILE_NAME)
+
+    @property
+    def embedding_function(self) -> Any:
+        if self._embedding_function is None:
+            # 与 Chroma 保持一致，默认使用 all-MiniLM-L6-v2 模型进行 embeddings
+            from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+            self._embedding_function = DefaultEmbeddingFunction()
+        return self._embedding_function
+
+    def _load(self) -> None:
+        if not (os.path.exists(self.embeddings_path) and os.path.exists(self.sidecar_path)):
+            return
+        with open(self.sidecar_path, "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        matrix = np.load(self.embeddings_path, mmap_mode="r")
+        if matrix.shape[0] != len(sidecar["ids"]):
+            raise ValueError(
+                f"The vector snapshot in {self.path} is inconsistent: {matrix.shape[0]} embeddings for {len(sidecar['ids'])} ids."
+            )
+        self._dtype = sidecar["dtype"]
+        self._matrix = matrix
+        self._ids = sidecar["ids"]
+        self._documents = sidecar["documents"]
+        self._metadatas = sidecar["metadatas"]
+        self._id_to_index = {id: index for index, id in enumerate(self._ids)}
+
+    def _consolidate(self) -> np.ndarray:
+        # 将缓存的新增向量合并到矩阵中，需要在持有锁时调用
+        if self._pending_rows:
+            rows = np.stack(self._pending_rows)
+            matrix = rows if self._matrix is None else np.vstack(
+                [self._matrix, rows])
+            self._matrix, self._pending_rows, self._dequantized_matrix = matrix, [], None
+        return self._matrix
+
+    def persist(self) -> None:
+        """将内存中的变更写入向量快照，批量添加向量后只需调用一次。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            matrix = self._consolidate()
+            sidecar = {
+                "dtype": self._dtype,
+                "ids": self._ids,
+                "documents": self._documents,
+                "metadatas": self._metadatas
+            }
+            os.makedirs(self.path, exist_ok=True)
+            # 先写入临时文件再替换，保证快照的完整性；有变更时矩阵已在内存中，不会占用被替换文件的内存映射
+            embeddings_tmp_path = self.embeddings_path + ".tmp.npy"
+            np.save(embeddings_tmp_path, matrix)
+            os.replace(embeddings_tmp_path, self.embeddings_path)
+            sidecar_tmp_path = self.sidecar_path + ".tmp"
+            with open(sidecar_tmp_path, "w", encoding="utf-8") as f:
+                json.dump(sidecar, f, ensure_ascii=False)
+            os.replace(sidecar_tmp_path, self.sidecar_path)
+            self._dirty = False
+
+    def _quantize(self, embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+        if self._dtype == "int8":
+            return np.round(embeddings * INT8_SCALE).astype(np.int8)
+        return embeddings.astype(SUPPORTED_DTYPES[self._dtype])
+
+    def _dequantize(self, matrix: np.ndarray) -> np.ndarray:
+        if self._dtype == "float32":
+            return np.asarray(matrix, dtype=np.float32)
+        # 量化会改变向量的长度，重新归一化后余弦距离才与 float32 的快照处于相同的范围
+        matrix = matrix.astype(np.float32)
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    def _as_list(self, value: Any) -> Optional[List[Any]]:
+        if value is None:
+            return None
+        return list(value) if isinstance(value, (list, tuple)) else [value]
+
+    def count(self) -> int:
+        """Return the number of embeddings in the collection."""
+        with self._lock:
+            return len(self._ids)
+
+    def _search_matrix(self) -> np.ndarray:
+        # float32 直接使用内存映射的矩阵，量化后的矩阵在首次使用时反量化并缓存，需要在持有锁时调用
+        if self._dequantized_matrix is None and self._consolidate() is not None:
+            self._dequantized_matrix = self._dequantize(self._matrix)
+        return self._dequantized_matrix
+
+    def warm_up(self) -> None:
+        """将内存映射的向量矩阵读入页缓存，避免首次查询时再从磁盘加载。"""
+        with self._lock:
+            if self._ids:
+                float(self._search_matrix().sum())
+
+    def add(
+        self,
+        ids: str | List[str],
+        documents: Optional[str | List[str]] = None,
+        metadatas: Optional[Dict[str, Any] | List[Dict[str, Any]]] = None,
+        embeddings: Optional[List[List[float]]] = None
+    ) -> None:
+        """添加向量到集合中，id 已存在时会覆盖原有的内容。
+        添加的内容立即可以被检索，需要调用 persist 才会写入向量快照。
+
+        Args:
+            ids (str | List[str]): 一至多个id
+            documents (Optional[str | List[str]], optional): 与id对应的文档. Defaults to None.
+            metadatas (Optional[Dict[str, Any] | List[Dict[str, Any]]], optional): 与id对应的元数据. Defaults to None.
+            embeddings (Optional[List[List[float]]], optional): 与id对应的向量，为空时使用嵌入函数对文档进行计算. Defaults to None.
+        """
+        ids = self._as_list(ids)
+        documents = self._as_list(documents) or [None] * len(ids)
+        metadatas = self._as_list(metadatas) or [None] * len(ids)
+        if embeddings is None:
+            if any(document is None for document in documents):
+                raise ValueError(
+                    "You must provide either embeddings or documents.")
+            embeddings = self.embedding_function(documents)
+        new_rows = self._quantize(embeddings)
+        with self._lock:
+            for row, id, document, metadata in zip(new_rows, ids, documents, metadatas):
+                if id in self._id_to_index:
+                    index = self._id_to_index[id]
+                    persisted_count = 0 if self._matrix is None else len(self._matrix)
+                    if index < persisted_count:
+                        if not self._matrix.flags.writeable:
+                            # 覆盖已有的向量时复制一次内存映射的矩阵
+                            self._matrix = np.array(self._matrix)
+                        self._matrix[index] = row
+                    else:
+                        self._pending_rows[index - persisted_count] = row
+                    self._documents[index] = document
+                    self._metadatas[index] = metadata
+                else:
+                    self._id_to_index[id] = len(self._ids)
+                    self._ids.append(id)
+                    self._documents.append(document)
+                    self._metadatas.append(metadata)
+                    self._pending_rows.append(row)
+            self._dequantized_matrix = None
+            self._dirty = True
+
+    def get(
+        self,
+        ids: Optional[str | List[str]] = None,
+        limit: Optional[int] = None,
+        include: List[str] = ["metadatas", "documents"]
+    ) -> Dict[str, Any]:
+        """根据id获取集合中的内容，不指定id时返回全部内容。
+
+        Args:
+            ids (Optional[str | List[str]], optional): 一至多个id. Defaults to None.
+            limit (Optional[int], optional): 返回的最大数量. Defaults to None.
+            include (List[str], optional): 需要返回的内容，可选 embeddings、documents、metadatas. Defaults to ["metadatas", "documents"].
+
+        Returns:
+            Dict[str, Any]: 与 chromadb 的 GetResult 格式一致的结果
+        """
+        ids = self._as_list(ids)
+        with self._lock:
+            if ids is None:
+                indices = list(range(len(self._ids)))
+            else:
+                indices = [self._id_to_index[id]
+                           for id in ids if id in self._id_to_index]
+            if limit is not None:
+                indices = indices[:limit]
+            return {
+                "ids": [self._ids[i] for i in indices],
+                "embeddings": [self._search_matrix()[i].tolist() for i in indices] if "embeddings" in include else None,
+                "documents": [self._documents[i] for i in indices] if "documents" in include else None,
+                "metadatas": [self._metadatas[i] for i in indices] if "metadatas" in include else None,
+            }
+
+    def query(
+        self,
+        query_texts: Optional[List[str]] = None,
+        query_embeddings: Optional[List[List[float]]] = None,
+        n_results: int = 10,
+        include: List[str] = ["metadatas", "documents", "distances"]
+    ) -> Dict[str, Any]:
+        """精确检索与查询内容最相似的 n_results 个结果。
+
+        Args:
+            query_texts (Optional[List[str]], optional): 查询文本，使用嵌入函数计算向量. Defaults to None.
+            query_embeddings (Optional[List[List[float]]], optional): 查询向量. Defaults to None.
+            n_results (int, optional): 每个查询返回的结果数量. Defaults to 10.
+            include (List[str], optional): 需要返回的内容，可选 embeddings、documents、metadatas、distances. Defaults to ["metadatas", "documents", "distances"].
+
+        Returns:
+            Dict[str, Any]: 与 chromadb 的 QueryResult 格式一致的结果
+        """
+        if query_embeddings is None:
+            if query_texts is None:
+                raise ValueError(
+                    "You must provide either query_texts or query_embeddings.")
+            query_embeddings = self.embedding_function(query_texts)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries / \
+            np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        result = {key: [] for key in ["ids", "embeddings",
+                                      "documents", "metadatas", "distances"]}
+        with self._lock:
+            n_results = min(n_results, len(self._ids))
+            if n_results > 0:
+                # 向量已预先归一化，内积即为余弦相似度
+                similarities = queries @ self._search_matrix().T
+            for query_index in range(len(queries)):
+                if n_results > 0:
+                    scores = similarities[query_index]
+                    top_k = np.argpartition(-scores, n_results - 1)[:n_results]
+                    top_k = top_k[np.argsort(-scores[top_k])]
+                    distances = np.maximum(0.0, 1.0 - scores[top_k]).tolist()
+                    embeddings = self._search_matrix()[top_k].tolist() if "embeddings" in include else []
+                else:
+                    top_k, distances, embeddings = [], [], []
+                result["ids"].append([self._ids[i] for i in top_k])
+                result["documents"].append([self._documents[i] for i in top_k])
+                result["metadatas"].append([self._metadatas[i] for i in top_k])
+                result["distances"].append(distances)
+                result["embeddings"].append(embeddings)
+        for key in ["embeddings", "documents", "metadatas", "distances"]:
+            if key not in include:
+                result[key] = None
+        return result
+
+    def import_from_chroma(self, collection: Any) -> None:
+        """从 Chroma 的向量集合中导入全部内容并写入向量快照，id 已存在时会覆盖原有的内容。
+
+        Args:
+            collection (Collection): Chroma 的向量集合，需要与当前集合使用相同的嵌入函数
+        """
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        if len(data["ids"]) > 0:
+            self.add(ids=data["ids"], documents=data["documents"],
+                     metadatas=data["metadatas"], embeddings=data["embeddings"])
+            self.persist()
+        print(
+            f"Imported {len(data['ids'])} embeddings from chroma collection {collection.name} to {self.path}")
+
+    def export_to_chroma(self, collection: Any) -> None:
+        """将全部内容导出到 Chroma 的向量集合中，id 已存在时会覆盖原有的内容。
+
+        Args:
+            collection (Collection): Chroma 的向量集合
+        """
+        data = self.get(include=["embeddings", "documents", "metadatas"])
+        if not data["ids"]:
+            return
+        collection.upsert(ids=data["ids"], embeddings=data["embeddings"],
+                          documents=data["documents"], metadatas=data["metadatas"])
+        print(
+            f"Exported {len(data['ids'])} embeddings from {self.path} to chroma collection {collection.name}")